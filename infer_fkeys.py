@@ -1,45 +1,351 @@
 """
 infer_fkeys.py - infer foreign key relationships by field content
 
-ABANDONED: major conceptual flaw, any field with a small set of ints
-as possible values is a subset of any other field that contains those
-ints.  This code doesn't consider the uniqueness of fields as a
-criteria for being an FK, but that would only help a little.
+For DBs without declared foreign keys (SQLite, or PostgreSQL without
+constraints) ``pydb2access.py --infer-fks`` uses this to fill the
+_LOOKUPS table.  It can also be run on CSV files, e.g. from xml2csv.py:
+
+    python infer_fkeys.py *.csv
+
+Holding every value of every field and comparing all pairs of fields
+is too slow, and any field with a small set of ints as values is a
+subset of any other field containing those ints.  So instead:
+
+ - each field gets a small sketch as the data is read: value and null
+   counts, min / max, kind (int, float, text), and a Bloom filter of
+   values, sized for the table's row count, which also gives an
+   estimate of distinct values
+ - a field can only refer to a unique, null free field of the same kind
+   in another table, whose range covers it, and whose Bloom filter has
+   all the bits set in its Bloom filter
+ - only the surviving candidates are checked exactly, by an anti-join
+   in the source DB or by re-reading the CSV files, then ranked by score,
+   and each field is matched to its best scoring verified candidate
 
 Terry Brown, Terry_N_Brown@yahoo.com, Sun Apr 24 13:20:37 2016
 """
 
+import argparse
+import binascii
 import csv
+import math
 import os
 import sys
+import zlib
+
+BLOOM_BITS = 2**24  # max. per field, 2 MB, see bloom_bits()
+BLOOM_BITS_PER_ROW = 10  # about 2% false positives with 3 hashes
+BLOOM_HASHES = 3
+
+# kinds of field which can be keys, floats can't
+KEY_KINDS = 'int', 'text'
+
+# candidates scoring less than this aren't verified, so a field with
+# no name match must use at least half the referenced field's values,
+# which drops e.g. a quantity of 1-5 "referring" to a serial id, fields
+# with a name match always score at least 1
+MIN_SCORE = 0.5
+def bloom_bits(rows, limit=BLOOM_BITS):
+    """bloom_bits - Bloom filter size for a field with `rows` rows
+
+    Sizes are powers of two, so filters of different sizes can be
+    compared by folding the bigger one, see fold().
+
+    :param int rows: rows in table, None if unknown
+    :param int limit: max. bits
+    :return: bits
+    :rtype: int
+    """
+    bits = 1024
+    while bits < limit and (rows is None or bits < rows * BLOOM_BITS_PER_ROW):
+        bits *= 2
+    return bits
+def fold(mask, bits, to_bits):
+    """fold - fold a Bloom filter as a long down to a smaller power of two
+    size, bit b of the result is set if any bit b + n * to_bits was set
+
+    :param long mask: Bloom filter, see Sketch.mask()
+    :param int bits: size of `mask`
+    :param int to_bits: size wanted
+    :rtype: long
+    """
+    while bits > to_bits:
+        bits //= 2
+        mask = (mask >> bits) | (mask & ((1 << bits) - 1))
+    return mask
+def kind_of(text):
+    """kind_of - return 'int', 'float', or 'text' for text `text`"""
+    try:
+        int(text)
+        return 'int'
+    except ValueError:
+        pass
+    try:
+        float(text)
+        return 'float'
+    except ValueError:
+        return 'text'
+class Sketch(object):
+    """Compact summary of the values in one field"""
+
+    KINDS = ['int', 'float', 'text']  # most to least specific
+
+    def __init__(self, bits=BLOOM_BITS):
+        self.bits = bloom_bits(None, bits)  # round up to power of two
+        self.bloom = bytearray(self.bits // 8)
+        self.count = 0
+        self.nulls = 0
+        self.distinct = 0  # values which set a new Bloom bit
+        self.kind = 'int'
+        self.min = self.max = None  # numeric, until kind is 'text'
+        self.tmin = self.tmax = None  # text
+        self._mask = None
+    def add(self, value):
+        """add - add a value to the sketch
+
+        :param unicode value: value as text, None or '' for null
+        """
+        if value is None or value == '':
+            self.nulls += 1
+            return
+        self.count += 1
+
+        if self.kind != 'text':
+            kind = kind_of(value)
+            if self.KINDS.index(kind) > self.KINDS.index(self.kind):
+                self.kind = kind
+            if kind != 'text':
+                number = float(value)
+                if self.min is None or number < self.min:
+                    self.min = number
+                if self.max is None or number > self.max:
+                    self.max = number
+        if self.tmin is None or value < self.tmin:
+            self.tmin = value
+        if self.tmax is None or value > self.tmax:
+            self.tmax = value
+
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if self.bloom is None:  # mask() was called, unpack it
+            self.bloom = bytearray(binascii.unhexlify(
+                '%0*x' % (self.bits // 4, self._mask)))
+        h1 = zlib.crc32(value) & 0xffffffff
+        h2 = (zlib.adler32(value) & 0xffffffff) | 1
+        new = False
+        for i in range(BLOOM_HASHES):
+            bit = (h1 + i * h2) % self.bits
+            if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                self.bloom[bit >> 3] |= 1 << (bit & 7)
+                new = True
+        if new:
+            self.distinct += 1
+        self._mask = None
+    def false_positive_rate(self):
+        """Chance a value not seen is reported as seen by the Bloom filter"""
+        return (1 - math.exp(-BLOOM_HASHES * float(self.count) / self.bits)) \
+            ** BLOOM_HASHES
+    def unique(self):
+        """unique - does this field look unique, allowing for Bloom filter
+        false positives, which make duplicates seem more common"""
+        return self.count > 0 and \
+            self.count - self.distinct <= self.count * self.false_positive_rate()
+    def mask(self):
+        """Bloom filter as a long, for fast subset tests, replacing the
+        bytearray so the filter isn't held twice"""
+        if self._mask is None:
+            self._mask = int(binascii.hexlify(self.bloom), 16)
+            self.bloom = None
+        return self._mask
+    def covers(self, other):
+        """covers - could every value in sketch `other` be in this sketch
 
+        :param Sketch other: sketch of the referring field
+        :rtype: bool
+        """
+        if other.kind != self.kind:
+            return False
+        if self.kind == 'text':
+            low, high = (self.tmin, self.tmax), (other.tmin, other.tmax)
+        else:
+            low, high = (self.min, self.max), (other.min, other.max)
+        if high[0] < low[0] or high[1] > low[1]:
+            return False
+        bits = min(self.bits, other.bits)
+        return fold(other.mask(), other.bits, bits) & \
+            ~fold(self.mask(), self.bits, bits) == 0
+def name_score(child, parent):
+    """name_score - how well field names suggest `child` refers to `parent`
+
+    :param tuple child: (table, field) of referring field
+    :param tuple parent: (table, field) of referenced field
+    :return: 1 for e.g. orders.customer_id -> customers.id,
+             0.5 for the same field name in both, otherwise 0
+    :rtype: float
+    """
+    table = parent[0].split('.')[-1].lower()
+    stems = [table]
+    # statuses -> status, customers -> customer, but not class -> clas
+    if table.endswith('es'):
+        stems.append(table[:-2])
+    if table.endswith('s') and not table.endswith('ss'):
+        stems.append(table[:-1])
+    field = child[1].lower()
+    if any(stem in field for stem in stems if stem):
+        return 1.
+    if field == parent[1].lower():
+        return 0.5
+    return 0.
+def candidates(sketches):
+    """candidates - find possible foreign keys from field sketches
+
+    :param dict sketches: {(table, field): Sketch}
+    :return: [(score, child (table, field), parent (table, field)),...],
+             best first
+    :rtype: list
+    """
+
+    parents = [(key, sketch) for key, sketch in sketches.items()
+               if sketch.kind in KEY_KINDS and not sketch.nulls and
+               sketch.unique()]
+    found = []
+    for child, sketch in sketches.items():
+        if sketch.kind not in KEY_KINDS or sketch.distinct < 2:
+            continue
+        for parent, parent_sketch in parents:
+            if parent[0] == child[0] or sketch.distinct > parent_sketch.count:
+                continue
+            names = name_score(child, parent)
+            if sketch.unique() and names < 1:
+                # e.g. a serial id in a table covered by a bigger
+                # table's serial id
+                continue
+            if not parent_sketch.covers(sketch):
+                continue
+            score = 2 * names + float(sketch.distinct) / parent_sketch.distinct
+            if score >= MIN_SCORE:
+                found.append((score, child, parent))
+
+    found.sort(key=lambda x: (-x[0], x[1], x[2]))
+    return found
+def verify_sql(cur, child, parent, savepoint=False):
+    """verify_sql - check a foreign key exactly in the source DB, the
+    referenced field must be unique and an anti-join must find no
+    values of the referring field which aren't in the referenced field
+
+    :param PEP 249 cursor cur: cursor for source DB
+    :param tuple child: (table, field) of referring field
+    :param tuple parent: (table, field) of referenced field
+    :param bool savepoint: run check in a savepoint, for PostgreSQL,
+        where an error aborts the whole transaction, including the
+        `set search_path` from pydb2access.con_cur()
+    :rtype: bool
+    """
+    if savepoint:
+        cur.execute("savepoint verify_sql")
+    try:
+        cur.execute('select count(*), count(distinct "%s") from %s' %
+                    (parent[1], parent[0]))
+        rows, distinct = cur.fetchone()
+        if rows != distinct:
+            return False
+        cur.execute("""
+            select count(*) from %s c
+             where c."%s" is not null
+               and not exists (select 1 from %s p where p."%s" = c."%s")
+        """ % (child[0], child[1], parent[0], parent[1], child[1]))
+        ok = cur.fetchone()[0] == 0
+    except Exception as e:
+        # e.g. PostgreSQL type mismatch, text = integer
+        sys.stderr.write("Can't check %s.%s -> %s.%s: %s\n" % (
+            child + parent + (str(e).strip(),)))
+        if savepoint:
+            cur.execute("rollback to savepoint verify_sql")
+        return False
+    if savepoint:
+        cur.execute("release savepoint verify_sql")
+    return ok
+def csv_column(path, field):
+    """csv_column - iterate over non-empty values of `field` in CSV file"""
+    reader = csv.reader(open(path, 'rb'))
+    n = next(reader).index(field)
+    for row in reader:
+        if row[n] != '':
+            yield row[n]
+def verify_csv(paths, child, parent):
+    """verify_csv - check a foreign key exactly by re-reading CSV files
+
+    :param dict paths: {table: path to CSV file}
+    :param tuple child: (table, field) of referring field
+    :param tuple parent: (table, field) of referenced field
+    :rtype: bool
+    """
+    values = set()
+    for value in csv_column(paths[parent[0]], parent[1]):
+        if value in values:
+            return False
+        values.add(value)
+    return all(value in values
+               for value in csv_column(paths[child[0]], child[1]))
+def infer(sketches, verify):
+    """infer - verify candidates and pick the best for each field
+
+    :param dict sketches: {(table, field): Sketch}
+    :param function verify: verify(child, parent) -> bool, exact check
+    :return: [(score, child, parent),...] for accepted keys, best first
+    :rtype: list
+    """
+    accepted = []
+    done = set()
+    for score, child, parent in candidates(sketches):
+        if child in done:
+            continue
+        if verify(child, parent):
+            accepted.append((score, child, parent))
+            done.add(child)
+    return accepted
+def as_fks(accepted):
+    """as_fks - convert infer() output to pydb2access.get_fks() format
+
+    :param list accepted: from infer()
+    :return: {(schema, table, field): (schema, table, field)}, schema None
+    :rtype: dict
+    """
+    return {(None,) + child: (None,) + parent
+            for score, child, parent in accepted}
 def main():
 
-    content = {}
-    for filename in sys.argv[1:]:
-        reader = csv.reader(open(filename))
+    parser = argparse.ArgumentParser(
+        description="""Infer foreign keys from the content of CSV files"""
+    )
+    parser.add_argument('files', type=str, nargs='+',
+        help="CSV files, one per table, with field names in first row"
+    )
+    parser.add_argument("--bloom-bits", type=int, default=BLOOM_BITS,
+        help="max. size of per field Bloom filter, which is sized from the "
+             "table's row count"
+    )
+    opt = parser.parse_args()
+
+    paths = {}
+    sketches = {}
+    for path in opt.files:
+        table = os.path.splitext(os.path.basename(path))[0]
+        paths[table] = path
+        rows = sum(1 for i in open(path, 'rb')) - 1  # can over count
+        bits = bloom_bits(rows, opt.bloom_bits)
+        reader = csv.reader(open(path, 'rb'))
         fields = next(reader)
-        content[filename] = {
-            'fields': fields,
-            'content': [set() for i in fields],
-        }
+        table_sketches = [Sketch(bits) for i in fields]
+        for field, sketch in zip(fields, table_sketches):
+            sketches[(table, field)] = sketch
         for row in reader:
-            for n, col in enumerate(row):
-                try:
-                    content[filename]['content'][n].add(col)
-                except:
-                    print filename, n, row, col
-                    print content[filename]
-                    raise
-
-    for table0 in content:
-        for table1 in content:
-            if table1 == table0:
-                continue
-            for n0, field0 in enumerate(content[table0]['content']):
-                for n1, field1 in enumerate(content[table1]['content']):
-                    if field1.issubset(field0):
-                        print table1, content[table1]['fields'][n1], table0, content[table0]['fields'][n0]
+            for value, sketch in zip(row, table_sketches):
+                sketch.add(value.decode('utf-8'))
 
+    accepted = infer(sketches, lambda child, parent:
+                     verify_csv(paths, child, parent))
+    for score, child, parent in accepted:
+        print("%.2f %s.%s -> %s.%s" % ((score,) + child + parent))
 if __name__ == '__main__':
     main()
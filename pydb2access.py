@@ -9,11 +9,17 @@ Terry Brown, Terry_N_Brown@yahoo.com, Wed Jan  7 12:35:33 2015
 """
 
 import argparse
+import csv
 import datetime
 import getpass
+import json
 import os
 import re
+import shutil
+import sqlite3
 import sys
+import tempfile
+import time
 
 from collections import defaultdict, OrderedDict
 from xml.sax.saxutils import escape
@@ -31,6 +37,9 @@ except ImportError:
     sys.stderr.write("pydb2access requires lxml")
     exit(10)
 
+import infer_fkeys
+import xmlindex
+
 XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
 XSD_NS = "http://www.w3.org/2001/XMLSchema"
 OD_NS = "urn:schemas-microsoft-com:officedata"
@@ -190,6 +199,12 @@ def make_parser():
         help="list of types to exclude, get numbers using --show-types", default=[]
     )
 
+    parser.add_argument("--formats", type=str, nargs='+', default=['xml'],
+        choices=list(SINKS),
+        help="output formats, all written from a single read of the DB, "
+             "default xml (MS Access .xml and .xsd)"
+    )
+
     parser.add_argument("--prefix", type=str, default='',
         help="prefix for all exported table names, e.g. 'myschema_'"
     )
@@ -202,6 +217,38 @@ def make_parser():
         help="max. rows to output, per table, for testing"
     )
 
+    parser.add_argument("--stable", action='store_true',
+        help="Output tables in name order and rows in primary key order, "
+             "so unchanged data gives unchanged output"
+    )
+
+    parser.add_argument("--blocks", action='store_true',
+        help="Also write the .xml as separately gzipped blocks with a "
+             "manifest, for sending only changed blocks, implies --stable"
+    )
+
+    parser.add_argument("--block-rows", type=int, default=xmlindex.BLOCK_ROWS,
+        help="average rows per block for --blocks"
+    )
+
+    parser.add_argument("--plan", action='store_true',
+        help="Just estimate rows, size, and time for the export, from DB "
+             "statistics and a sample of rows, and exit"
+    )
+
+    parser.add_argument("--plan-sample", type=int, default=1000,
+        help="rows per table to sample for --plan"
+    )
+
+    parser.add_argument("--plan-count", action='store_true',
+        help="count rows in tables for --plan, instead of using "
+             "statistics, slow for big tables"
+    )
+
+    parser.add_argument("--plan-jobs", type=int, default=4,
+        help="number of parallel runs to suggest --tables for in --plan"
+    )
+
     parser.add_argument("--show-tables", action='store_true',
         help="Just show list of table names and exit"
     )
@@ -218,6 +265,17 @@ def make_parser():
         help="Order fields alphabetically"
     )
 
+    parser.add_argument("--infer-fks", action='store_true',
+        help="Infer relationships for _LOOKUPS from field content when "
+             "the DB has no foreign keys, e.g. SQLite"
+    )
+
+    parser.add_argument("--bloom-bits", type=int,
+        default=infer_fkeys.BLOOM_BITS,
+        help="max. size of per field Bloom filter for --infer-fks, which is "
+             "sized from the table's row count"
+    )
+
     parser.add_argument("--use-dml", type=str,
         help="Use the supplied DML file, not internal data, to "
              "define relationships"
@@ -228,7 +286,7 @@ def make_parser():
              "name as the table first"
     )
 
-   requiredNamed = parser.add_argument_group('required named arguments')
+    requiredNamed = parser.add_argument_group('required named arguments')
     requiredNamed.add_argument("--module", type=str, required=True,
         help="name of DB API module, 'sqlite3' or 'psycopg2' for PostgreSQL"
     )
@@ -282,7 +340,10 @@ def check_types(x, types):
             types.pop(0)
 def main():
 
-    opt = make_parser().parse_args()
+    parser = make_parser()
+    opt = parser.parse_args()
+    if opt.block_rows < 1:
+        parser.error("--block-rows must be at least 1")
     if opt.module == 'sqlite3':
         opt.infer_types = True
 
@@ -293,12 +354,22 @@ def main():
     if opt.password == 'prompt':
         opt.password = getpass.getpass("DB password: ")
 
-    tables = get_tables(opt, db249)
+    all_tables = get_tables(opt, db249)
+    tables = all_tables
     if opt.tables:
         tables = [i for i in tables if re_list_search(i, opt.tables)]
     opt.tables = tables
     opt.tables = [i for i in opt.tables if not re_list_search(i, opt.exclude_tables)]
 
+    if opt.blocks:
+        opt.stable = True
+    if opt.stable:
+        opt.tables.sort()
+
+    if opt.plan:
+        plan_export(opt, db249, all_tables)
+        exit(0)
+
     if opt.show_tables:
         print(' '.join(sorted(opt.tables)))
         exit(0)
@@ -322,46 +393,32 @@ def main():
     path = os.path.join(path, output)
     if not os.path.isdir(path):
         os.makedirs(path)
-    path = os.path.join(path, output+'.xml')
-    output = open(path, 'w')
-
-    type_map = dump_data(opt, db249, output, os.path.basename(path))
-
-    if opt.show_tables:
-        return
+    base = os.path.join(path, output)
 
-    if not opt.infer_types:
-        type_map = make_type_map(opt, db249)
+    # no duplicates, two XMLSinks would write the same file
+    sinks = [SINKS[i](opt, base) for i in OrderedDict.fromkeys(opt.formats)]
 
-    output = open(path[:-4] + '.xsd', 'w')
-
-    dump_schema(opt, type_map, output)
-def dump_data(opt, db249, output, output_path):
+    dump_data(opt, db249, sinks)
+def dump_data(opt, db249, sinks):
     """
-    dump_data - write data to .xml file
+    dump_data - read data from DB, inferring types, and pass it to each
+    output sink, so every output format comes from a single read of
+    each table
 
     :param argparse Namespace opt: options
     :param module db249: PEP 249 DB API 2 module to use
-    :param file output: open file
+    :param [Sink] sinks: outputs, see Sink
+    :return: type mappings
+    :rtype: dict
     """
 
-    E = ElementMaker(nsmap=NS_MAP)
-
     con, cur = con_cur(opt, db249)
 
-    db = E('dataroot')
-    db.set('{%s}noNamespaceSchemaLocation' % XSI_NS,
-           output_path.replace('.xml', '.xsd'))
-
-    # Convert this complete XML to an open element so that large
-    # datasets may be written without trying to hold the whole
-    # thing in memory.  Hence the "manual" XML output in the following.
-    template = etree.tostring(etree.ElementTree(db),
-                              encoding='UTF-8', xml_declaration=True)
-    template = template.replace("/>", ">")
-    output.write(template+'\n')
+    for sink in sinks:
+        sink.begin()
 
     type_map = defaultdict(lambda: list(TYPES))
+    sketches = {}  # see --infer-fks
 
     types_used = get_types(opt, db249)
 
@@ -370,52 +427,259 @@ def dump_data(opt, db249, output, output_path):
         fields = [i for i in fields
                   if str(types_used[(table_name, i)]) not in opt.exclude_types]
         q = "select %s from %s" % (', '.join('"%s"' % i for i in fields), table_name)
+        if opt.stable:
+            order = get_order(opt, cur, table_name, fields)
+            if order:
+                q += " order by %s" % ', '.join('"%s"' % i for i in order)
         if opt.limit is not None:
             q += ' limit %d' % opt.limit
+        for sink in sinks:
+            sink.begin_table(table_name, fields)
         cur.execute(q)
         print("Table %d/%d '%s', %d rows." % (table_n+1, len(opt.tables), table_name, cur.rowcount))
+        if opt.infer_fks:
+            # size Bloom filters for the table
+            rows = cur.rowcount
+            if rows < 0:  # e.g. SQLite, estimate using another cursor
+                rows = estimate_rows(opt, db249, con.cursor(), table_name)
+                if rows is not None and opt.limit is not None:
+                    rows = min(rows, opt.limit)
+            bits = infer_fkeys.bloom_bits(rows, opt.bloom_bits)
+            for field_name in fields:
+                sketches[(table_name, field_name)] = infer_fkeys.Sketch(bits)
+        row_n = -1
         for row_n, row in enumerate(cur):
-            output.write("<%s%s>\n" % (opt.prefix, table_name))
+            text = []
             for field_n, field_name in enumerate(fields):
 
                 x = row[field_n]
 
                 if x is None:
+                    if opt.infer_fks:
+                        sketches[(table_name, field_name)].add(None)
+                    text.append(None)
                     continue
 
                 if isinstance(x, str):
                     x = x.decode('utf-8')
                 if not isinstance(x, unicode):
                     x = unicode(x)
-                value = "<%s>%s</%s>\n" % (
-                    field_name, escape(x), field_name)
-
-                output.write(value.encode('utf-8'))
+                text.append(x)
 
                 if opt.infer_types:
                     key = (table_name, field_name)
                     if x is not None and len(type_map[key]) > 1:
                         check_types(x, type_map[key])
 
-            output.write("</%s%s>\n" % (opt.prefix, table_name))
+                if opt.infer_fks:
+                    sketches[(table_name, field_name)].add(x)
+
+            for sink in sinks:
+                sink.row(table_name, fields, row, text)
+
+        for sink in sinks:
+            sink.end_table(table_name, row_n+1)
 
     type_map["_FKS"] = get_fks(opt, db249)
+    if not type_map["_FKS"] and opt.infer_fks:
+        accepted = infer_fkeys.infer(sketches, lambda child, parent:
+            infer_fkeys.verify_sql(cur, child, parent,
+                                   savepoint=opt.module == 'psycopg2'))
+        for score, child, parent in accepted:
+            print("Inferred %.2f %s.%s -> %s.%s" % ((score,) + child + parent))
+        type_map["_FKS"] = infer_fkeys.as_fks(accepted)
     if type_map["_FKS"]:
+        lookups = sorted((k[1], k[2], v[1], v[2])
+                         for k, v in type_map["_FKS"].items()
+                         if (k[1], k[2]) in type_map and (v[1], v[2]) in type_map)
+        for sink in sinks:
+            sink.lookups(lookups)
 
-        for k, v in type_map["_FKS"].items():
-            if (k[1], k[2]) in type_map and (v[1], v[2]) in type_map:
-                output.write("<%s%s>\n" % (opt.prefix, '_LOOKUPS'))
-                output.write("<from_table>%s</from_table>\n" % k[1])
-                output.write("<from_field>%s</from_field>\n" % k[2])
-                output.write("<to_table>%s</to_table>\n" % v[1])
-                output.write("<to_field>%s</to_field>\n" % v[2])
-                output.write("</%s%s>\n" % (opt.prefix, '_LOOKUPS'))
+    if not opt.infer_types:
+        type_map = make_type_map(opt, db249)
 
-    output.write("</dataroot>\n")
-    output.close()
+    for sink in sinks:
+        sink.finish(type_map)
 
     return type_map
 
+class Sink(object):
+    """Output for dump_data(), which calls begin(), then begin_table()
+    (before the table's query is run), row() for each row, and
+    end_table() for each table, then lookups() if there are
+    relationships, then finish()
+    """
+    def __init__(self, opt, base):
+        """
+        :param argparse Namespace opt: options
+        :param str base: path for output, without extension
+        """
+        self.opt = opt
+        self.base = base
+    def begin(self):
+        pass
+    def begin_table(self, table_name, fields):
+        pass
+    def row(self, table_name, fields, row, text):
+        """
+        :param str table_name: table name
+        :param [str] fields: field names
+        :param tuple row: values from DB
+        :param [unicode] text: values as text, None for NULL
+        """
+        pass
+    def end_table(self, table_name, rows):
+        pass
+    def lookups(self, lookups):
+        """
+        :param list lookups: [(from_table, from_field, to_table, to_field),...]
+        """
+        pass
+    def finish(self, type_map):
+        pass
+class XMLSink(Sink):
+    """MS Access .xml data and .xsd schema, plus .idx, see xmlindex.py"""
+    def begin(self):
+
+        self.output = open(self.base+'.xml', 'w')
+
+        E = ElementMaker(nsmap=NS_MAP)
+
+        db = E('dataroot')
+        db.set('{%s}noNamespaceSchemaLocation' % XSI_NS,
+               os.path.basename(self.base)+'.xsd')
+
+        # Convert this complete XML to an open element so that large
+        # datasets may be written without trying to hold the whole
+        # thing in memory.  Hence the "manual" XML output in the following.
+        template = etree.tostring(etree.ElementTree(db),
+                                  encoding='UTF-8', xml_declaration=True)
+        template = template.replace("/>", ">")
+        self.output.write(template+'\n')
+
+        # byte offset, length and row count of each table's run of elements
+        self.header = self.output.tell()
+        self.index = []
+    def begin_table(self, table_name, fields):
+        self.offset = self.output.tell()
+    def row(self, table_name, fields, row, text):
+        tag = self.opt.prefix + table_name
+        xml = [u"<%s>\n" % tag]
+        for field_name, x in zip(fields, text):
+            if x is not None:
+                xml.append(u"<%s>%s</%s>\n" % (field_name, escape(x), field_name))
+        xml.append(u"</%s>\n" % tag)
+        self.output.write(u''.join(xml).encode('utf-8'))
+    def end_table(self, table_name, rows):
+        self.index.append({'name': self.opt.prefix+table_name,
+                           'offset': self.offset,
+                           'length': self.output.tell() - self.offset,
+                           'rows': rows})
+    def lookups(self, lookups):
+        self.begin_table('_LOOKUPS', None)
+        for from_table, from_field, to_table, to_field in lookups:
+            self.output.write("<%s%s>\n" % (self.opt.prefix, '_LOOKUPS'))
+            self.output.write("<from_table>%s</from_table>\n" % from_table)
+            self.output.write("<from_field>%s</from_field>\n" % from_field)
+            self.output.write("<to_table>%s</to_table>\n" % to_table)
+            self.output.write("<to_field>%s</to_field>\n" % to_field)
+            self.output.write("</%s%s>\n" % (self.opt.prefix, '_LOOKUPS'))
+        self.end_table('_LOOKUPS', len(lookups))
+    def finish(self, type_map):
+        self.output.write("</dataroot>\n")
+        xmlindex.write_index(xmlindex.index_path(self.base+'.xml'),
+                             os.path.basename(self.base)+'.xml',
+                             self.output.tell(), self.header, self.index)
+        self.output.close()
+        dump_schema(self.opt, type_map, open(self.base+'.xsd', 'w'))
+        if self.opt.blocks:
+            xmlindex.write_blocks(self.base+'.xml', self.opt.block_rows)
+class CSVSink(Sink):
+    """One .csv file per table, in the output folder"""
+    def begin_table(self, table_name, fields):
+        self.output = open(os.path.join(os.path.dirname(self.base),
+                                        self.opt.prefix+table_name+'.csv'),
+                           'wb')
+        self.writer = csv.writer(self.output)
+        self.writer.writerow(fields)
+    def row(self, table_name, fields, row, text):
+        # unicode(float) keeps only 12 significant digits, repr() keeps all
+        self.writer.writerow([repr(x) if isinstance(x, float) else
+                              '' if y is None else y.encode('utf-8')
+                              for x, y in zip(row, text)])
+    def end_table(self, table_name, rows):
+        self.output.close()
+    def lookups(self, lookups):
+        self.begin_table('_LOOKUPS', LOOKUP_FIELDS)
+        self.writer.writerows(lookups)
+        self.end_table('_LOOKUPS', len(lookups))
+class JSONLSink(Sink):
+    """One .jsonl file per table, one JSON object per row, in the
+    output folder.  Numbers, booleans, and nulls are kept, other values
+    are written as text"""
+    def begin_table(self, table_name, fields):
+        self.output = open(os.path.join(os.path.dirname(self.base),
+                                        self.opt.prefix+table_name+'.jsonl'),
+                           'wb')
+    def row(self, table_name, fields, row, text):
+        self.output.write(json.dumps(OrderedDict(
+            (field_name, x if isinstance(x, JSON_TYPES) or x is None else y)
+            for field_name, x, y in zip(fields, row, text))) + '\n')
+    def end_table(self, table_name, rows):
+        self.output.close()
+    def lookups(self, lookups):
+        self.begin_table('_LOOKUPS', LOOKUP_FIELDS)
+        for lookup in lookups:
+            self.row('_LOOKUPS', LOOKUP_FIELDS, lookup, lookup)
+        self.end_table('_LOOKUPS', len(lookups))
+class SQLiteSink(Sink):
+    """SQLite DB, one table per table, with values of types SQLite can
+    store kept, others stored as text.  Rows are inserted in batches with
+    executemany(), one transaction per table"""
+    def begin(self):
+        path = self.base+'.sqlite3'
+        if os.path.exists(path):
+            os.remove(path)
+        self.con = sqlite3.connect(path)
+        self.con.execute("pragma journal_mode = off")
+        self.con.execute("pragma synchronous = off")
+    def begin_table(self, table_name, fields):
+        table_name = self.opt.prefix + table_name
+        self.con.execute('create table "%s" (%s)' % (
+            table_name, ', '.join('"%s"' % i for i in fields)))
+        self.insert = 'insert into "%s" values (%s)' % (
+            table_name, ', '.join('?' for i in fields))
+        self.batch = []
+    def row(self, table_name, fields, row, text):
+        self.batch.append([x if isinstance(x, SQLITE_TYPES) or x is None else y
+                           for x, y in zip(row, text)])
+        if len(self.batch) >= SQLITE_BATCH:
+            self.con.executemany(self.insert, self.batch)
+            self.batch = []
+    def end_table(self, table_name, rows):
+        if self.batch:
+            self.con.executemany(self.insert, self.batch)
+        self.con.commit()
+    def lookups(self, lookups):
+        self.begin_table('_LOOKUPS', LOOKUP_FIELDS)
+        self.batch = lookups
+        self.end_table('_LOOKUPS', len(lookups))
+    def finish(self, type_map):
+        self.con.close()
+
+LOOKUP_FIELDS = ['from_table', 'from_field', 'to_table', 'to_field']
+# DB values written as they are, not as text
+JSON_TYPES = (bool, int, long, float)
+SQLITE_TYPES = (int, long, float, unicode, buffer)
+SQLITE_BATCH = 10000  # rows per executemany()
+
+SINKS = OrderedDict([
+    ('xml', XMLSink),
+    ('csv', CSVSink),
+    ('jsonl', JSONLSink),
+    ('sqlite', SQLiteSink),
+])
+
 def dump_schema(opt, type_map, output):
     """
     dump_schema - Write XML-Schema to .xsd file
@@ -506,6 +770,108 @@ def sort_fields(fields, table_name):
     guess_table = table_name.split('_', 1)[-1]
     return sorted(fields, key=lambda x: ' ' if x == guess_table else x)
 
+def get_pk(opt, cur, table_name):
+    """get_pk - return primary key field names for table, or failing
+    that the fields of a unique index, preferring one on NOT NULL fields
+
+    :param argparse namespace opt: options
+    :param PEP 249 cursor cur: cursor to access DB
+    :param str table_name: table name
+    :return: field names, empty if no key or unknown
+    :rtype: [str]
+    """
+
+    if opt.module == 'sqlite3':
+        cur.execute('pragma table_info("%s")' % table_name)
+        # (cid, name, type, notnull, dflt_value, pk), pk is position in key
+        info = cur.fetchall()
+        pk = [i[1] for i in sorted(info, key=lambda x: x[5]) if i[5]]
+        if pk:
+            return pk
+        notnull = set(i[1] for i in info if i[3])
+        keys = []
+        cur.execute('pragma index_list("%s")' % table_name)
+        # (seq, name, unique, origin, partial), partial since SQLite 3.8.9
+        for index in cur.fetchall():
+            if not index[2] or len(index) > 4 and index[4]:
+                continue
+            cur.execute('pragma index_info("%s")' % index[1])
+            # (seqno, cid, name), name None for expressions
+            fields = [i[2] for i in sorted(cur.fetchall())]
+            if None not in fields:
+                keys.append((not notnull.issuperset(fields), len(fields),
+                             fields))
+        return min(keys)[2] if keys else []
+
+    if opt.module == 'psycopg2':
+        cur.execute("""
+            select array_agg(attname
+                             order by array_position(indkey::int2[], attnum))
+              from pg_index
+                   join pg_attribute on attrelid = indrelid
+                                    and attnum = any(indkey)
+             where indrelid = %s::regclass and indisunique
+                   and indpred is null and indexprs is null
+             group by indexrelid, indisprimary, indnatts
+             order by indisprimary desc, bool_and(attnotnull) desc,
+                      indnatts, indexrelid
+             limit 1
+        """, [table_name])
+        row = cur.fetchone()
+        return row[0] if row else []
+
+    return []
+def get_orderable(opt, cur, table_name, fields):
+    """get_orderable - return the fields which can be used in ORDER BY,
+    not e.g. PostgreSQL json or point fields
+
+    :param argparse namespace opt: options
+    :param PEP 249 cursor cur: cursor to access DB
+    :param str table_name: table name
+    :param [str] fields: field names
+    :return: field names
+    :rtype: [str]
+    """
+
+    if opt.module != 'psycopg2':
+        return fields
+
+    cur.execute("""
+        select attname
+          from pg_attribute
+         where attrelid = %s::regclass and attnum > 0
+               and exists (select 1
+                             from pg_opclass join pg_am on pg_am.oid = opcmethod
+                            where amname = 'btree' and opcdefault
+                                  and opcintype = atttypid)
+    """, [table_name])
+    orderable = set(i[0] for i in cur.fetchall())
+    return [i for i in fields if i in orderable]
+def get_order(opt, cur, table_name, fields):
+    """get_order - return fields to order rows by for --stable, the
+    primary key or a unique index, or else all orderable fields, with a
+    warning, as that's a full sort and may not give a unique order
+
+    :param argparse namespace opt: options
+    :param PEP 249 cursor cur: cursor to access DB
+    :param str table_name: table name
+    :param [str] fields: field names being exported
+    :return: field names
+    :rtype: [str]
+    """
+
+    key = get_pk(opt, cur, table_name)
+    if key and set(key) <= set(fields):
+        return key
+
+    order = get_orderable(opt, cur, table_name, fields)
+    sys.stderr.write("Table '%s' has no primary key or unique index, "
+                     "ordering by all fields" % table_name)
+    if len(order) < len(fields):
+        sys.stderr.write(" except unorderable %s" %
+                         ', '.join(i for i in fields if i not in order))
+    sys.stderr.write("\n")
+    return order
 def get_fks(opt, db249):
     """get_fks - return schema.table.field -> schema.table.field foreign key info
 
@@ -549,6 +915,208 @@ def get_fks(opt, db249):
     return ans
 
 
+class TimingSink(Sink):
+    """Records seconds and rows for each table, from before its query
+    is run until all sinks before this one have its rows, for --plan"""
+    def begin(self):
+        self.seconds = {}
+        self.rows = {}
+    def begin_table(self, table_name, fields):
+        self.start = time.time()
+    def end_table(self, table_name, rows):
+        self.seconds[table_name] = time.time() - self.start
+        self.rows[table_name] = rows
+
+def estimate_rows(opt, db249, cur, table):
+    """estimate_rows - cheap row count for `table` from DB statistics,
+    without reading the table
+
+    :param argparse Namespace opt: options
+    :param module db249: PEP 249 DB API 2 module
+    :param PEP 249 cursor cur: cursor for source DB
+    :param str table: table name
+    :return: rows, None if unknown
+    :rtype: int
+    """
+
+    rows = None
+    if opt.module == 'psycopg2':
+        cur.execute("select reltuples from pg_class where oid = %s::regclass",
+                    [table])
+        rows = cur.fetchone()[0]
+        rows = int(rows) if rows >= 0 else None  # -1, never analyzed
+    elif opt.module == 'sqlite3':
+        try:
+            # first number in stat is rows in table, needs ANALYZE
+            cur.execute("select stat from sqlite_stat1 where tbl = ?",
+                        [table])
+            stat = cur.fetchone()
+            if stat:
+                rows = int(stat[0].split()[0])
+        except db249.Error:  # no sqlite_stat1
+            pass
+        if rows is None:
+            try:
+                # an index lookup, exact if no rows were deleted
+                cur.execute("select max(rowid) from %s" % table)
+                rows = cur.fetchone()[0] or 0
+            except db249.Error:  # WITHOUT ROWID table
+                pass
+    return rows
+def table_stats(opt, db249):
+    """table_stats - cheap row count and size on disk for each table,
+    from DB statistics, rows None if unknown, unless --plan-count
+
+    :param argparse Namespace opt: options
+    :param module db249: PEP 249 DB API 2 module
+    :return: {table: (rows or None, bytes or None)}
+    :rtype: dict
+    """
+
+    con, cur = con_cur(opt, db249)
+    stats = {}
+
+    for table in opt.tables:
+        rows = estimate_rows(opt, db249, cur, table)
+        size = None
+        if opt.module == 'psycopg2':
+            cur.execute("select pg_relation_size(%s::regclass)", [table])
+            size = cur.fetchone()[0]
+        elif opt.module == 'sqlite3':
+            try:
+                cur.execute("select sum(pgsize) from dbstat where name = ?",
+                            [table])
+                size = cur.fetchone()[0]
+            except db249.Error:  # SQLite built without dbstat
+                pass
+        if opt.plan_count:
+            cur.execute("select count(*) from %s" % table)
+            rows = cur.fetchone()[0]
+        stats[table] = (rows, size)
+
+    return stats
+def sample_bytes(opt, base, table_name):
+    """sample_bytes - bytes written for `table_name` by the --formats
+    sinks during the --plan sample
+
+    :param argparse Namespace opt: options
+    :param str base: output path the sample sinks used
+    :param str table_name: table name
+    :return: bytes, and formats which couldn't be measured
+    :rtype: (int, [str])
+    """
+    size = 0
+    unknown = []
+    folder = os.path.dirname(base)
+    for format_ in OrderedDict.fromkeys(opt.formats):
+        if format_ == 'xml':
+            index = xmlindex.load_index(base+'.xml')
+            size += xmlindex.table_entry(index, opt.prefix+table_name)['length']
+        elif format_ in ('csv', 'jsonl'):
+            size += os.path.getsize(os.path.join(
+                folder, "%s%s.%s" % (opt.prefix, table_name, format_)))
+        elif format_ == 'sqlite':
+            con = sqlite3.connect(base+'.sqlite3')
+            try:
+                size += con.execute(
+                    "select sum(pgsize) from dbstat where name = ?",
+                    [opt.prefix+table_name]).fetchone()[0] or 0
+            except sqlite3.Error:  # SQLite built without dbstat
+                unknown.append(format_)
+            con.close()
+    return size, unknown
+def plan_export(opt, db249, all_tables):
+    """plan_export - show estimated rows, output size, and time, per
+    table and in total, from DB statistics and timing a sample of rows
+    through dump_data() and the --formats sinks, written to a temporary
+    folder, and show which tables and types are excluded
+
+    :param argparse Namespace opt: options
+    :param module db249: PEP 249 DB API 2 module
+    :param [str] all_tables: all tables, before --tables etc.
+    """
+
+    excluded = sorted(set(all_tables) - set(opt.tables))
+    if excluded:
+        print("Excluded tables: %s" % ' '.join(excluded))
+    if opt.exclude_types:
+        types = get_types(opt, db249)
+        fields = sorted("%s.%s" % k for k, v in types.items()
+                        if str(v) in opt.exclude_types)
+        print("Excluded fields (--exclude-types): %s" %
+              (' '.join(fields) or 'none'))
+    if opt.limit is not None:
+        print("Rows per table limited to %d (--limit)" % opt.limit)
+
+    stats = table_stats(opt, db249)
+
+    sample_opt = argparse.Namespace(**vars(opt))
+    sample_opt.limit = opt.plan_sample
+    if opt.limit is not None:
+        sample_opt.limit = min(opt.limit, opt.plan_sample)
+    sample_opt.infer_fks = False  # verification reads whole tables
+    sample_opt.blocks = False
+    folder = tempfile.mkdtemp()
+    base = os.path.join(folder, 'sample')
+    timer = TimingSink(sample_opt, base)
+    # timer last, so its end_table() follows the others'
+    dump_data(sample_opt, db249,
+              [SINKS[i](sample_opt, base)
+               for i in OrderedDict.fromkeys(opt.formats)] + [timer])
+
+    estimates = {}
+    unknown = set()
+    for table in opt.tables:
+        rows, size = stats[table]
+        if rows is not None and opt.limit is not None:
+            rows = min(rows, opt.limit)
+        n = max(timer.rows[table], 1)
+        output, missing = sample_bytes(opt, base, table)
+        unknown.update(missing)
+        estimates[table] = (rows, size) + (
+            (None, None) if rows is None else
+            (float(output) * rows / n, timer.seconds[table] * rows / n))
+    shutil.rmtree(folder)
+
+    def show(value, format_):
+        return '?' if value is None else format_ % value
+
+    print("")
+    print("Output formats: %s" % ' '.join(OrderedDict.fromkeys(opt.formats)))
+    if unknown:
+        print("Output MB excludes: %s" % ' '.join(sorted(unknown)))
+    print("%-32s %12s %12s %12s %10s" % (
+        "table", "rows", "DB MB", "output MB", "seconds"))
+    order = sorted(opt.tables, key=lambda x: -(estimates[x][3] or 0))
+    for table in order:
+        rows, size, output, seconds = estimates[table]
+        print("%-32s %12s %12s %12s %10s" % (
+            table, show(rows, '%d'), show(size and size / 1e6, '%.1f'),
+            show(output and output / 1e6, '%.1f'), show(seconds, '%.1f')))
+    known = [i for i in estimates.values() if i[0] is not None]
+    print("%-32s %12d %12s %12.1f %10.1f" % (
+        "TOTAL", sum(i[0] for i in known),
+        '?' if any(i[1] is None for i in estimates.values())
+        else "%.1f" % (sum(i[1] for i in estimates.values()) / 1e6),
+        sum(i[2] for i in known) / 1e6,
+        sum(i[3] for i in known)))
+    if len(known) < len(estimates):
+        print("%d tables with no row count statistics not in TOTAL, "
+              "use --plan-count to count them" % (len(estimates) - len(known)))
+
+    # longest first, each to the least loaded run
+    runs = [[0, []] for i in range(max(opt.plan_jobs, 1))]
+    for table in order:
+        run = min(runs, key=lambda x: x[0])
+        run[0] += estimates[table][3] or 0
+        run[1].append(table)
+    runs = [i for i in runs if i[1]]
+    print("")
+    print("Suggested %d parallel runs, longest tables first:" % len(runs))
+    for seconds, tables in runs:
+        print("  %.1f s: --tables %s" % (
+            seconds, ' '.join("'^%s$'" % i for i in tables)))
+
 def re_list_search(text, re_list):
     """re_list_search - see if text matches any regular expressions in re_list
 
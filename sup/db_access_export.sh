@@ -33,6 +33,33 @@ export_db () {
 
 }
 
+export_db_blocks () {
+
+  # like export_db, but with --blocks, and rsync only the blocks which
+  # changed since the last run to a fixed folder on the destination,
+  # which can rebuild the .xml with
+  #   python pydb2access/xmlindex.py $SCHEMA.manifest --reassemble $SCHEMA.xml
+
+  SCHEMA=$1
+  DSN=$2
+  DEST=$3
+
+  python pydb2access/pydb2access.py \
+    --module psycopg2 \
+    --exclude-types 29555946 \
+    --exclude-tables userlog \
+    --dsn "$DSN" \
+    --top-id \
+    --schema $SCHEMA \
+    --blocks \
+    /tmp/$SCHEMA
+
+  # /tmp/$SCHEMA is kept, unchanged blocks are reused and not re-sent
+  rsync -a --delete --exclude $SCHEMA.xml \
+    /tmp/$SCHEMA/ example.com:/home/user/exports/$SCHEMA/
+
+}
+
 TS=$(date '+%Y%m%d%H%M')
 
 # export three sets of data, from two databases
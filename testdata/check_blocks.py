@@ -0,0 +1,60 @@
+"""
+check_blocks.py - check that deleting or inserting one row changes
+at most two of the blocks written by pydb2access.py --blocks
+
+    python check_blocks.py
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+TESTDB = "test_data.sqlite3"
+PYDB2ACCESS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'pydb2access.py')
+
+def export(db, output):
+    """export - export `db` with --blocks, return set of block files"""
+    subprocess.check_call([
+        sys.executable, PYDB2ACCESS, '--module', 'sqlite3', '--database', db,
+        '--blocks', '--block-rows', '50', output,
+    ], stdout=open(os.devnull, 'w'))
+    manifest = json.load(open(os.path.join(output, 'out.manifest')))
+    return set(i['file'] for i in manifest['blocks'])
+
+def main():
+
+    folder = tempfile.mkdtemp()
+    db = os.path.join(folder, TESTDB)
+    shutil.copy(TESTDB, db)
+    output = os.path.join(folder, 'out')
+
+    failed = False
+    before = export(db, output)
+    for change in [
+        "delete from test_table_1 where anInt = 5",
+        "insert into test_table_1 (aString, anInt) values ('new', 1001)",
+        "update test_table_1 set aFloat = 0 where anInt = 500",
+    ]:
+        con = sqlite3.connect(db)
+        con.execute(change)
+        con.commit()
+        con.close()
+        after = export(db, output)
+        print("%d of %d blocks new after %s" % (
+            len(after - before), len(after), change))
+        if len(after - before) > 2:
+            failed = True
+        before = after
+
+    shutil.rmtree(folder)
+    if failed:
+        print("FAILED, more than two blocks changed")
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+check_fkeys.py - check that pydb2access.py --infer-fks finds foreign
+keys suggested by field names, and not small ints which happen to be a
+subset of a serial id
+
+    python check_fkeys.py
+"""
+
+import csv
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+PYDB2ACCESS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'pydb2access.py')
+
+EXPECTED = set([
+    ('orders', 'customer_id', 'customers', 'id'),
+    ('orders', 'status', 'statuses', 'code'),
+])
+
+def make_db(path):
+    """make_db - make a DB with two real foreign keys, and two fields of
+    small ints, visits.minutes and visits.age, contained in products.pid"""
+    con = sqlite3.connect(path)
+    con.executescript("""
+        create table customers (id integer primary key, name text);
+        create table statuses (code integer primary key, label text);
+        create table orders (oid integer primary key, customer_id integer,
+                             status integer);
+        create table products (pid integer primary key, name text);
+        create table visits (vid integer primary key, minutes integer,
+                             age integer);
+    """)
+    con.executemany("insert into customers values (?, ?)",
+                    [(i, 'customer %d' % i) for i in range(1, 51)])
+    con.executemany("insert into statuses values (?, ?)",
+                    [(i, 'status %d' % i) for i in range(1, 9)])
+    con.executemany("insert into orders values (?, ?, ?)",
+                    [(i, i % 50 + 1, i % 8 + 1) for i in range(1, 201)])
+    con.executemany("insert into products values (?, ?)",
+                    [(i, 'product %d' % i) for i in range(1, 1001)])
+    con.executemany("insert into visits values (?, ?, ?)",
+                    [(i, i % 90 + 1, i % 63 + 18) for i in range(1, 501)])
+    con.commit()
+    con.close()
+
+def main():
+
+    folder = tempfile.mkdtemp()
+    db = os.path.join(folder, 'fkeys.sqlite3')
+    make_db(db)
+    output = os.path.join(folder, 'out')
+
+    subprocess.check_call([
+        sys.executable, PYDB2ACCESS, '--module', 'sqlite3', '--database', db,
+        output, '--formats', 'csv', '--infer-fks',
+    ], stdout=open(os.devnull, 'w'))
+    reader = csv.reader(open(os.path.join(output, '_LOOKUPS.csv'), 'rb'))
+    next(reader)
+    found = set(tuple(i) for i in reader)
+    shutil.rmtree(folder)
+
+    for lookup in sorted(found | EXPECTED):
+        if lookup not in found:
+            status = 'MISSING'
+        elif lookup not in EXPECTED:
+            status = 'WRONG'
+        else:
+            status = 'found'
+        print("%s %s.%s -> %s.%s" % ((status,) + lookup))
+    if found != EXPECTED:
+        print("FAILED, inferred foreign keys differ from expected")
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -5,3 +5,5 @@ echo
 echo git should not report a change in test_out/test_out.*
 echo
 
+python check_blocks.py
+python check_fkeys.py
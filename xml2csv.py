@@ -1,72 +1,282 @@
 """
-xml2csv.py - simple re-processing of .xml output of pydb2access.py
-to csv
+xml2csv.py - re-processing of .xml output of pydb2access.py
+to csv, JSON lines, or an SQLite DB
 
-https://mail.python.org/pipermail/python-dev/2000-October/009946.html
+Rows are read with lxml's iterparse(), clearing each row after use, so
+memory use doesn't grow with the size of the export.  When the .idx
+file written by pydb2access.py is present each table is read directly
+from its offset in the .xml (see xmlindex.py), and --jobs tables are
+converted at once.  Without it, the .xml is read in a single pass.
+With --format sqlite all jobs write to one DB file, so writes wait for
+each other's transactions, only parsing and conversion run in parallel.
+
+    python xml2csv.py export/export --format sqlite --jobs 4
+
+Requires lxml - http://lxml.de/ (pip install lxml)
 
 Terry Brown, Terry_N_Brown@yahoo.com, Sat Apr 23 19:15:33 2016
 """
 
+import argparse
 import csv
 import json
+import multiprocessing
 import os
+import sqlite3
 import sys
-from xml.sax import make_parser, handler
-from xml.sax.saxutils import unescape
-class SchemaHandler(handler.ContentHandler):
-    def __init__(self, tables=None):
-        self.path = []
-        self.tables = {}
-    def startElement(self, name, attrs):
-        self.path.append((name, attrs.get('name')))
-    def endElement(self, name):
-
-        if len(self.path) == 5:
-            self.tables.setdefault(self.path[1][1], []).append(self.path[4][1])
-
-        del self.path[-1]
-class DBHandler(handler.ContentHandler):
-
-    def __init__(self, ref_tables):
-        self.path = []
-        self.table = None
-        self.tables = {}
-        self.ref_tables = ref_tables
-        self.writer = None
-        self.row = {}
-
-    def startElement(self, name, attrs):
-        self.path.append(name)
-    def characters(self, content):
-        if len(self.path) == 3:
-            self.row[self.path[2]] = unescape(content)
-    def endElement(self, name):
-
-        if len(self.path) != 2:
-            del self.path[-1]
-            return
-        if self.table != self.path[1]:
-            self.table = self.path[1]
-            sys.stderr.write("%s\n" % self.table)
-            self.writer = csv.writer(open(self.table+'.csv', 'wb'))
-            self.writer.writerow(self.ref_tables[self.path[1]])
-
-        self.writer.writerow([self.row.get(i, '').encode('utf-8') for i in self.ref_tables[self.path[1]]])
-        self.row = {}
-
-        del self.path[-1]
+import time
+
+from collections import OrderedDict
+
+try:
+    from lxml import etree
+except ImportError:
+    sys.stderr.write("xml2csv requires lxml")
+    exit(10)
+
+import xmlindex
+
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+
+# .xsd type -> (Python conversion, SQLite column type)
+TYPES = {
+    'xsd:integer': (int, 'INTEGER'),
+    'xsd:double': (float, 'REAL'),
+}
+TEXT_TYPE = (unicode, 'TEXT')
+
+FORMATS = ['csv', 'jsonl', 'sqlite']
+def make_parser():
+    """Return an argparse parser"""
+
+    parser = argparse.ArgumentParser(
+        description="""Convert pydb2access.py .xml output to csv, """
+                    """JSON lines, or SQLite"""
+    )
+
+    parser.add_argument('base', type=str,
+        help="path to .xml and .xsd files, without extension"
+    )
+
+    parser.add_argument("--format", choices=FORMATS, default='csv',
+        help="output format, default csv"
+    )
+
+    parser.add_argument("--output", type=str, default='.',
+        help="folder for output files, default current folder"
+    )
+
+    parser.add_argument("--tables", type=str, nargs='+', default=[],
+        help="list of tables to convert, omit for all"
+    )
+
+    parser.add_argument("--jobs", type=int, default=1,
+        help="number of tables to convert at once, needs .idx file, "
+             "SQLite writes are still one at a time"
+    )
+
+    parser.add_argument("--batch", type=int, default=1000,
+        help="rows per write / SQLite transaction"
+    )
+
+    return parser
+def read_schema(path):
+    """read_schema - get field names and types from .xsd file
+
+    :param str path: path to .xsd file
+    :return: {table: [(field, xsd type), ...]}, fields in .xsd order
+    :rtype: OrderedDict
+    """
+
+    tables = OrderedDict()
+    xsd = etree.parse(path).getroot()
+    for table in xsd.iterchildren('{%s}element' % XSD_NS):
+        if table.get('name') == 'dataroot':
+            continue
+        tables[table.get('name')] = [
+            (field.get('name'), field.get('type', 'xsd:string'))
+            for field in table.iterfind(
+                '{%s}complexType/{%s}sequence/{%s}element' %
+                (XSD_NS, XSD_NS, XSD_NS))
+        ]
+    return tables
+def iter_rows(source, tables=None):
+    """iter_rows - yield rows from a pydb2access.py .xml file
+
+    :param file source: path or file like object
+    :param set tables: tables to return, omit for all
+    :return: iterator of (table, {field: text})
+    """
+
+    depth = 0
+    for event, elem in etree.iterparse(source, events=('start', 'end'),
+                                       huge_tree=True):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if not tables or elem.tag in tables:
+            yield elem.tag, dict((i.tag, i.text or '') for i in elem)
+        # drop the row, and preceding rows still referenced by <dataroot>
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+def convert(text, type_):
+    """convert - convert text from .xml to Python type for .xsd `type_`,
+    returning text if that fails
+    """
+    if text is None:
+        return None
+    try:
+        return TYPES.get(type_, TEXT_TYPE)[0](text)
+    except ValueError:
+        return text
+class CSVWriter(object):
+    """Write rows for one table to <table>.csv, appending if the table's
+    rows weren't contiguous in the .xml"""
+    def __init__(self, opt, table, fields, append=False):
+        self.fields = [i[0] for i in fields]
+        path = os.path.join(opt.output, table+'.csv')
+        self.file = open(path, 'ab' if append else 'wb')
+        self.writer = csv.writer(self.file)
+        if not append:
+            self.writer.writerow(self.fields)
+    def write(self, rows):
+        self.writer.writerows(
+            [[row.get(i, '').encode('utf-8') for i in self.fields]
+             for row in rows])
+    def close(self):
+        self.file.close()
+class JSONLWriter(object):
+    """Write rows for one table to <table>.jsonl, one JSON object per line"""
+    def __init__(self, opt, table, fields, append=False):
+        self.fields = fields
+        self.file = open(os.path.join(opt.output, table+'.jsonl'),
+                         'ab' if append else 'wb')
+    def write(self, rows):
+        self.file.write(''.join(
+            json.dumps(OrderedDict(
+                (name, convert(row.get(name), type_))
+                for name, type_ in self.fields)) + '\n'
+            for row in rows))
+    def close(self):
+        self.file.close()
+class SQLiteWriter(object):
+    """Write rows for one table to a table in <base>.sqlite3, column
+    types from the .xsd"""
+    def __init__(self, opt, table, fields, append=False):
+        self.fields = fields
+        path = os.path.join(opt.output,
+                            os.path.basename(opt.base)+'.sqlite3')
+        # other processes may hold the write lock, see --jobs
+        self.con = sqlite3.connect(path, timeout=3600)
+        if not append:
+            self.con.execute('drop table if exists "%s"' % table)
+        self.con.execute('create table if not exists "%s" (%s)' % (
+            table, ', '.join('"%s" %s' % (name, TYPES.get(type_, TEXT_TYPE)[1])
+                             for name, type_ in fields)))
+        self.insert = 'insert into "%s" values (%s)' % (
+            table, ', '.join('?' for i in fields))
+    def write(self, rows):
+        with self.con:  # one transaction per batch
+            self.con.executemany(self.insert, [
+                [convert(row.get(name), type_) for name, type_ in self.fields]
+                for row in rows])
+    def close(self):
+        self.con.close()
+
+WRITERS = {
+    'csv': CSVWriter,
+    'jsonl': JSONLWriter,
+    'sqlite': SQLiteWriter,
+}
+def write_rows(opt, schema, rows):
+    """write_rows - write rows to output, batching and opening / closing
+    one output at a time as the table changes
+
+    :param argparse Namespace opt: options
+    :param dict schema: from read_schema()
+    :param iter rows: iterator of (table, {field: text})
+    :return: {table: row count}
+    :rtype: OrderedDict
+    """
+
+    counts = OrderedDict()
+    table = writer = None
+    batch = []
+    for row_table, row in rows:
+        if row_table != table or len(batch) >= opt.batch:
+            if batch:
+                writer.write(batch)
+                batch = []
+        if row_table != table:
+            if writer:
+                writer.close()
+            table = row_table
+            writer = WRITERS[opt.format](opt, table, schema[table],
+                                         append=table in counts)
+            counts.setdefault(table, 0)
+        batch.append(row)
+        counts[table] += 1
+    if batch:
+        writer.write(batch)
+    if writer:
+        writer.close()
+    return counts
+def convert_table(args):
+    """convert_table - convert one table using the .idx file,
+    for multiprocessing
+
+    :param tuple args: (options, schema, table name)
+    :return: {table: row count}
+    :rtype: OrderedDict
+    """
+    opt, schema, table = args
+    start = time.time()
+    reader = xmlindex.open_table(opt.base+'.xml', table)
+    counts = write_rows(opt, schema, iter_rows(reader))
+    reader.close()
+    report(counts, time.time() - start)
+    return counts
+def report(counts, seconds):
+    """report - show rows converted and throughput on stderr"""
+    for table, rows in counts.items():
+        sys.stderr.write("%s: %d rows, %.1f s, %d rows/s\n" % (
+            table, rows, seconds, rows / max(seconds, 0.001)))
 def main():
 
-    parser = make_parser()
+    opt = make_parser().parse_args()
+    if opt.base.endswith('.xml'):
+        opt.base = opt.base[:-4]
+    if not os.path.isdir(opt.output):
+        os.makedirs(opt.output)
 
-    handler = SchemaHandler()
-    parser.setContentHandler(handler)
-    parser.parse(sys.argv[1]+'.xsd')
+    start = time.time()
+    schema = read_schema(opt.base+'.xsd')
 
-    handler = DBHandler(handler.tables)
-    parser.setContentHandler(handler)
-    parser.parse(sys.argv[1]+'.xml')
+    if os.path.exists(xmlindex.index_path(opt.base+'.xml')):
+        tables = [i['name'] for i in
+                  xmlindex.load_index(opt.base+'.xml')['tables']
+                  if not opt.tables or i['name'] in opt.tables]
+        tasks = [(opt, schema, i) for i in tables]
+        if opt.jobs > 1:
+            pool = multiprocessing.Pool(opt.jobs)
+            results = pool.map(convert_table, tasks, chunksize=1)
+            pool.close()
+        else:
+            results = map(convert_table, tasks)
+        rows = sum(sum(i.values()) for i in results)
+    else:
+        if opt.jobs > 1:
+            sys.stderr.write("No .idx file, ignoring --jobs\n")
+        counts = write_rows(opt, schema,
+                            iter_rows(opt.base+'.xml', set(opt.tables)))
+        rows = sum(counts.values())
 
-    print json.dumps(handler.ref_tables, indent=4)
+    seconds = time.time() - start
+    sys.stderr.write("Total: %d rows, %.1f s, %d rows/s\n" % (
+        rows, seconds, rows / max(seconds, 0.001)))
 if __name__ == '__main__':
     main()
@@ -0,0 +1,316 @@
+"""
+xmlindex.py - random access into the .xml output of pydb2access.py
+
+pydb2access.py writes the rows of each table as one contiguous run of
+elements, and records the byte offset, length and row count of each
+run in a sidecar .idx file (JSON) next to the .xml.  With that, one
+table can be read without parsing everything before it, and a big
+export can be split so tables are processed in parallel.
+
+The index is also used to cut the .xml into separately gzipped blocks of
+rows (``pydb2access.py --blocks``) listed in a .manifest file.  Blocks are
+named by the SHA-256 of their content, so with rows in a stable order
+only blocks which changed need to be sent, and the receiver rebuilds the
+identical .xml from the manifest.
+
+    python xmlindex.py export/export.xml              # list index
+    python xmlindex.py export/export.xml mytable      # one table to stdout
+    python xmlindex.py export/export.xml --split dir  # one .xml per table
+    python xmlindex.py export/export.manifest --needed     # blocks missing
+    python xmlindex.py export/export.manifest --reassemble out.xml
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+# size of reads when copying a table's run of elements
+CHUNK = 1024 * 1024
+
+# average rows per block, see write_blocks()
+BLOCK_ROWS = 10000
+# max. block size, as multiple of average
+BLOCK_MAX = 4
+
+def index_path(xml_path):
+    """index_path - return path of sidecar index for `xml_path`
+
+    :param str xml_path: path to .xml file
+    :return: path to .idx file
+    :rtype: str
+    """
+    return os.path.splitext(xml_path)[0] + '.idx'
+def write_index(path, xml_name, size, header, tables):
+    """write_index - write sidecar index
+
+    :param str path: path of .idx file to write
+    :param str xml_name: basename of .xml file indexed
+    :param int size: size of .xml file in bytes
+    :param int header: length in bytes of XML declaration and <dataroot>
+    :param list tables: dicts with name, offset, length, rows, in file order
+    """
+    index = {
+        'xml': xml_name,
+        'size': size,
+        'header': header,
+        'tables': tables,
+    }
+    with open(path, 'w') as out:
+        json.dump(index, out, indent=1, separators=(',', ': '), sort_keys=True)
+        out.write('\n')
+def load_index(xml_path):
+    """load_index - load sidecar index for `xml_path`, checking it matches
+
+    :param str xml_path: path to .xml file
+    :return: index
+    :rtype: dict
+    """
+    index = json.load(open(index_path(xml_path)))
+    if os.path.getsize(xml_path) != index['size']:
+        raise ValueError("%s does not match %s, size differs" %
+                         (index_path(xml_path), xml_path))
+    return index
+def table_entry(index, table):
+    """table_entry - return index entry for `table`
+
+    :param dict index: index from load_index()
+    :param str table: table (element) name, including any --prefix
+    :return: entry with offset, length, rows
+    :rtype: dict
+    """
+    for entry in index['tables']:
+        if entry['name'] == table:
+            return entry
+    raise KeyError("No table '%s' in index" % table)
+def read_table(xml_path, table, index=None):
+    """read_table - return the raw run of elements for `table`
+
+    :param str xml_path: path to .xml file
+    :param str table: table (element) name
+    :param dict index: index, loaded if not supplied
+    :return: UTF-8 encoded XML fragment, one element per row
+    :rtype: str
+    """
+    if index is None:
+        index = load_index(xml_path)
+    entry = table_entry(index, table)
+    with open(xml_path, 'rb') as xml:
+        xml.seek(entry['offset'])
+        return xml.read(entry['length'])
+class TableReader(object):
+    """File like object presenting one table's rows as a complete XML
+    document, by wrapping the run of elements in the original
+    declaration and <dataroot> element.  Suitable for passing to
+    SAX or lxml.etree.iterparse(), and read() with no size returns the
+    whole document, e.g. for lxml.etree.fromstring().
+    """
+    def __init__(self, xml_path, table, index=None):
+        if index is None:
+            index = load_index(xml_path)
+        entry = table_entry(index, table)
+        self.xml = open(xml_path, 'rb')
+        self.header = self.xml.read(index['header'])
+        self.xml.seek(entry['offset'])
+        self.remaining = entry['length']
+        self.footer = "</dataroot>\n"
+    def read(self, size=-1):
+        if size is None or size < 0:  # all the rest, as file.read() does
+            parts = []
+            while True:
+                text = self.read(CHUNK)
+                if not text:
+                    return ''.join(parts)
+                parts.append(text)
+        if self.header:
+            text, self.header = self.header[:size], self.header[size:]
+            return text
+        if self.remaining:
+            text = self.xml.read(min(size, self.remaining))
+            self.remaining -= len(text)
+            if not text:  # file truncated since indexing
+                self.remaining = 0
+            return text
+        text, self.footer = self.footer[:size], self.footer[size:]
+        return text
+    def close(self):
+        self.xml.close()
+def open_table(xml_path, table, index=None):
+    """open_table - return a file like object reading one table as a
+    standalone XML document, see TableReader
+
+    :param str xml_path: path to .xml file
+    :param str table: table (element) name
+    :param dict index: index, loaded if not supplied
+    :rtype: TableReader
+    """
+    return TableReader(xml_path, table, index=index)
+def split_tables(xml_path, out_dir, tables=None):
+    """split_tables - write each table to its own standalone .xml file
+
+    :param str xml_path: path to .xml file
+    :param str out_dir: folder for output, <table>.xml
+    :param [str] tables: tables to split out, omit for all
+    :return: paths written
+    :rtype: [str]
+    """
+    index = load_index(xml_path)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    paths = []
+    for entry in index['tables']:
+        if tables and entry['name'] not in tables:
+            continue
+        path = os.path.join(out_dir, entry['name'] + '.xml')
+        reader = open_table(xml_path, entry['name'], index=index)
+        with open(path, 'wb') as out:
+            while True:
+                text = reader.read(CHUNK)
+                if not text:
+                    break
+                out.write(text)
+        reader.close()
+        paths.append(path)
+    return paths
+def manifest_path(xml_path):
+    """manifest_path - return path of block manifest for `xml_path`"""
+    return os.path.splitext(xml_path)[0] + '.manifest'
+def block_dir(path):
+    """block_dir - return folder for blocks of .xml or .manifest `path`"""
+    return os.path.splitext(path)[0] + '.blocks'
+def write_blocks(xml_path, rows=BLOCK_ROWS):
+    """write_blocks - split .xml into gzipped blocks of about `rows`
+    rows, never spanning tables, and write a manifest listing them.
+    Blocks already present from a previous run are reused, blocks no
+    longer used are removed.
+
+    A block ends after a row whose text hashes to 0 mod `rows`, or
+    after BLOCK_MAX * `rows` rows, so where blocks end depends on the
+    rows, not their position.  Inserting, deleting, or changing a row
+    only changes the block it's in, or merges / splits that and the
+    next block, instead of shifting every later block in the table.
+
+    :param str xml_path: path to .xml file, with .idx file
+    :param int rows: average rows per block
+    :return: path to manifest
+    :rtype: str
+    """
+
+    index = load_index(xml_path)
+    folder = block_dir(xml_path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    blocks = []
+
+    def add(text, table):
+        digest = hashlib.sha256(text).hexdigest()
+        name = digest + '.gz'
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            # no file name or time stamp in header, same input, same output
+            with open(path+'.tmp', 'wb') as out:
+                block = gzip.GzipFile(filename='', mode='wb',
+                                      fileobj=out, mtime=0)
+                block.write(text)
+                block.close()
+            os.rename(path+'.tmp', path)
+        blocks.append({'file': name, 'sha256': digest, 'length': len(text),
+                       'size': os.path.getsize(path), 'table': table})
+
+    with open(xml_path, 'rb') as xml:
+        pos = 0
+        for entry in sorted(index['tables'], key=lambda x: x['offset']):
+            if entry['offset'] > pos:  # header, or anything between tables
+                add(xml.read(entry['offset'] - pos), None)
+            end = entry['offset'] + entry['length']
+            pos = entry['offset']
+            close = "</%s>\n" % entry['name']
+            chunk = []
+            row_start = 0  # index in chunk of current row's first line
+            count = 0
+            while pos < end:
+                line = xml.readline()
+                pos += len(line)
+                chunk.append(line)
+                # values are escaped, so only a row can end with this
+                if line == close:
+                    count += 1
+                    row = ''.join(chunk[row_start:])
+                    if zlib.crc32(row) % rows == 0 or \
+                       count >= rows * BLOCK_MAX:
+                        add(''.join(chunk), entry['name'])
+                        chunk = []
+                        count = 0
+                    row_start = len(chunk)
+            if chunk:
+                add(''.join(chunk), entry['name'])
+        add(xml.read(), None)  # </dataroot>
+
+    used = set(i['file'] for i in blocks)
+    for name in os.listdir(folder):
+        if name not in used:
+            os.remove(os.path.join(folder, name))
+
+    path = manifest_path(xml_path)
+    with open(path, 'w') as out:
+        json.dump({'xml': os.path.basename(xml_path), 'size': index['size'],
+                   'blocks': blocks},
+                  out, indent=1, separators=(',', ': '), sort_keys=True)
+        out.write('\n')
+    return path
+def needed_blocks(manifest, folder=None):
+    """needed_blocks - list blocks in manifest missing from `folder`
+
+    :param str manifest: path to .manifest file
+    :param str folder: folder with blocks, default next to manifest
+    :return: block file names
+    :rtype: [str]
+    """
+    folder = folder or block_dir(manifest)
+    names = []
+    for block in json.load(open(manifest))['blocks']:
+        if block['file'] not in names and \
+           not os.path.exists(os.path.join(folder, block['file'])):
+            names.append(block['file'])
+    return names
+def reassemble(manifest, xml_path, folder=None):
+    """reassemble - rebuild .xml from blocks listed in manifest,
+    checking each block's SHA-256
+
+    :param str manifest: path to .manifest file
+    :param str xml_path: path of .xml file to write
+    :param str folder: folder with blocks, default next to manifest
+    """
+    folder = folder or block_dir(manifest)
+    with open(xml_path, 'wb') as out:
+        for block in json.load(open(manifest))['blocks']:
+            text = gzip.open(os.path.join(folder, block['file'])).read()
+            if hashlib.sha256(text).hexdigest() != block['sha256']:
+                raise ValueError("Block %s is corrupt" % block['file'])
+            out.write(text)
+def main():
+
+    if len(sys.argv) < 2:
+        sys.stderr.write(__doc__)
+        exit(10)
+
+    xml_path = sys.argv[1]
+
+    if len(sys.argv) == 2:
+        for entry in load_index(xml_path)['tables']:
+            print("%s %d rows, %d bytes at %d" % (
+                entry['name'], entry['rows'], entry['length'], entry['offset']))
+    elif sys.argv[2] == '--needed':  # xml_path is the .manifest
+        for name in needed_blocks(xml_path):
+            print(name)
+    elif sys.argv[2] == '--reassemble':
+        reassemble(xml_path, sys.argv[3])
+    elif sys.argv[2] == '--split':
+        for path in split_tables(xml_path, sys.argv[3], sys.argv[4:]):
+            print(path)
+    else:
+        sys.stdout.write(read_table(xml_path, sys.argv[2]))
+if __name__ == '__main__':
+    main()